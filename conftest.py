@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+from price_fairness_calculator import VietnameseCarPriceAnalyzer
+
+
+def make_listings(rows=480, seed=0, price_scale=1):
+    """
+    Small synthetic market in the car.xlsx layout
+
+    Prices are whole millions of VND so sums (and therefore means) are exact, and every
+    brand stays under the default sketch size so sketches hold all of its prices.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'brand': rng.choice(['Toyota', 'Ford', 'Honda'], rows),
+        'model': rng.choice(['Vios', 'Ranger'], rows),
+        'condition': rng.choice(['used', 'new'], rows),
+        'manufacture_date': rng.choice([2018.0, 2020.0, np.nan], rows),
+        'mileage_v2': rng.choice([0, 5000, 10000, 10001, 45000, 120000, 120001, np.nan], rows),
+        'fuel': rng.choice(['petrol', 'diesel'], rows),
+        'price': rng.integers(300, 900, rows).astype(float) * 1_000_000 * price_scale,
+        'list_time': rng.integers(1_700_000_000_000, 1_710_000_000_000, rows)
+    })
+
+
+@pytest.fixture
+def listings():
+    return make_listings()
+
+
+@pytest.fixture
+def listings_factory():
+    """make_listings, for tests that need several different markets"""
+    return make_listings
+
+
+@pytest.fixture
+def load_analyzer(monkeypatch):
+    """Build a VietnameseCarPriceAnalyzer from a DataFrame instead of car.xlsx"""
+    def load(df, **kwargs):
+        monkeypatch.setattr(pd, 'read_excel', lambda data_file: df.copy())
+        return VietnameseCarPriceAnalyzer('car.xlsx', **kwargs)
+    return load
@@ -2,36 +2,177 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import json
+from quantile_sketch import KLLSketch, build_segment_sketches, k_for_error, merge_segment_sketches
+
+# Upper bounds (km) of the used-car mileage clusters; bucket 0 is reserved for new cars (0 km)
+MILEAGE_BUCKET_EDGES = [10000, 30000, 50000, 80000, 120000]
+UNKNOWN_MILEAGE_BUCKET = -1
+
+def mileage_bucket(mileage):
+    """Map a mileage in km to its cluster index (0 = new, 1-6 = used ranges)"""
+    if mileage == 0:
+        return 0
+    return 1 + int(np.searchsorted(MILEAGE_BUCKET_EDGES, mileage, side='left'))
+
+def mileage_buckets(mileages):
+    """Vectorized mileage_bucket for a Series of listing mileages (missing or negative -> -1)"""
+    values = mileages.to_numpy(dtype=float)
+    buckets = 1 + np.searchsorted(MILEAGE_BUCKET_EDGES, values, side='left')
+    buckets[values == 0] = 0
+    buckets[np.isnan(values) | (values < 0)] = UNKNOWN_MILEAGE_BUCKET
+    return pd.Series(buckets, index=mileages.index)
+
+def build_price_sketches(df, k=200):
+    """Build price sketches per brand/model/condition/year/mileage bucket, indexed by brand"""
+    if 'manufacture_date' in df.columns:
+        years = df['manufacture_date']
+    else:
+        years = pd.Series(None, index=df.index)
+    if 'mileage_v2' in df.columns:
+        buckets = mileage_buckets(df['mileage_v2'])
+    else:
+        buckets = pd.Series(UNKNOWN_MILEAGE_BUCKET, index=df.index)
+    
+    segments = build_segment_sketches(
+        df, [df['brand'], df['model'], df['condition'], years, buckets], k=k, seed=0
+    )
+    sketches = {}
+    for key, sketch in segments.items():
+        # NaN never equals itself, so missing key parts become None to stay mergeable across chunks
+        brand, model, condition, year, bucket = (None if pd.isna(part) else part for part in key)
+        if brand is None:
+            continue
+        sketches.setdefault(brand, {})[(model, condition, year, bucket)] = sketch
+    return sketches
+
+def merge_price_sketches(*partitions):
+    """Merge several build_price_sketches results (e.g. one per file or month) into one"""
+    merged = {}
+    for partition in partitions:
+        for brand, segments in partition.items():
+            merged[brand] = merge_segment_sketches(merged.get(brand, {}), segments)
+    return merged
+
+def build_price_sketches_from_chunks(chunks, k=200):
+    """Build the analyzer's price sketches from an iterable of listing DataFrames, one chunk at a time"""
+    merged = {}
+    for chunk in chunks:
+        merged = merge_price_sketches(merged, build_price_sketches(chunk, k))
+    return merged
 
 class VietnameseCarPriceAnalyzer:
-    def __init__(self, data_file='car.xlsx'):
-        """Initialize the analyzer with Vietnamese car market data"""
+    def __init__(self, data_file='car.xlsx', sketch_error=0.01, snapshot_store=None):
+        """
+        Initialize the analyzer with Vietnamese car market data
+
+        Args:
+            data_file (str): Path to the listings Excel file, or None to answer only
+                as_of queries from the snapshot_store without loading live data
+            sketch_error (float): Target rank error of the per-segment quantile sketches
+                used when a query runs with approximate=True
+            snapshot_store (MarketSnapshotStore): Optional store of past market versions
+                that query methods can target through their as_of argument
+        """
+        self.sketch_k = k_for_error(sketch_error)
+        self.snapshot_store = snapshot_store
+        if data_file is None:
+            if snapshot_store is None:
+                raise ValueError('data_file=None requires a snapshot_store')
+            self.df = None
+            self.price_sketches = None
+            return
+        
         self.df = pd.read_excel(data_file)
         self.df['list_date'] = pd.to_datetime(self.df['list_time'], unit='ms')
+        self.price_sketches = build_price_sketches(self.df, self.sketch_k)
         print(f"Loaded {len(self.df):,} Vietnamese car listings")
     
-    def calculate_fair_price_score(self, brand, model, year, mileage, price, condition='used'):
+    def _require_live_data(self):
+        if self.df is None:
+            raise ValueError('No live market data loaded; create the analyzer with a data_file or pass as_of')
+    
+    def _snapshot(self, as_of):
+        if self.snapshot_store is None:
+            raise ValueError('as_of requires the analyzer to be created with a snapshot_store')
+        return self.snapshot_store.attach(as_of)
+    
+    def _select(self, as_of=None, columns=None, **filters):
+        """Listings matching equality filters, from the live data or the snapshot for as_of"""
+        if as_of is not None:
+            return self._snapshot(as_of).select(columns, **filters)
+        self._require_live_data()
+        mask = pd.Series(True, index=self.df.index)
+        for column, value in filters.items():
+            mask &= self.df[column] == value
+        if columns is None:
+            return self.df[mask].copy()
+        return self.df.loc[mask, columns].copy()
+    
+    def _segment_sketches(self, as_of=None):
+        """Brand -> {(model, condition, year, mileage bucket): sketch} for the live data or a snapshot"""
+        if as_of is None:
+            self._require_live_data()
+            return self.price_sketches
+        return self._snapshot(as_of).price_sketches
+    
+    def _new_sketch(self, as_of=None):
+        """Empty sketch to merge segments into, sized like the live or snapshot segment sketches"""
+        k = self.sketch_k if as_of is None else self._snapshot(as_of).sketch_k
+        # Fixed seed keeps repeated queries over the same segments reproducible
+        return KLLSketch(k=k, seed=0)
+    
+    def save_snapshot(self, version, as_of_date=None):
+        """Persist the currently loaded market data as a new snapshot version"""
+        if self.snapshot_store is None:
+            raise ValueError('save_snapshot requires the analyzer to be created with a snapshot_store')
+        self._require_live_data()
+        return self.snapshot_store.save(
+            self.df, version, as_of_date, sketch_k=self.sketch_k, price_sketches=self.price_sketches
+        )
+    
+    def get_price_sketch(self, brand, model=None, condition=None, year=None, mileage_bucket=None, as_of=None):
         """
-        Calculate a fair price score (0-100) for a car based on Vietnamese market data
-        
-        Args:
-            brand (str): Car brand (e.g., 'Toyota', 'Ford')
-            model (str): Car model (e.g., 'Vios', 'Ranger')
-            year (int): Manufacturing year
-            mileage (int): Current mileage in km
-            price (float): Current listing price in VND
-            condition (str): 'new' or 'used'
-        
-        Returns:
-            dict: Analysis results including score, market data, and recommendations
+        Merge the price sketches of every segment matching the given filters
+
+        Filters left as None match all segments. The result is a new sketch, so callers
+        may keep merging into it without touching the stored segments.
         """
+        merged = self._new_sketch(as_of)
+        segments = self._segment_sketches(as_of).get(brand, {})
+        # Filter on keys before looking sketches up, so snapshots only load matching segments
+        for key in segments:
+            seg_model, seg_condition, seg_year, seg_bucket = key
+            if model is not None and seg_model != model:
+                continue
+            if condition is not None and seg_condition != condition:
+                continue
+            if year is not None and seg_year != year:
+                continue
+            if mileage_bucket is not None and seg_bucket != mileage_bucket:
+                continue
+            merged.merge(segments[key])
+        return merged
+    
+    def _approximate_market_stats(self, brand, model, mileage, price, condition, as_of=None):
+        """Market statistics for calculate_fair_price_score computed from segment sketches"""
+        sketch = self.get_price_sketch(brand, model, condition, as_of=as_of)
         
+        # Mirror the mileage clustering of the exact path using the bucketed sketches;
+        # without mileage data every listing sits in the unknown bucket and we fall back
+        if sketch.count > 10:
+            cluster = self.get_price_sketch(brand, model, condition, mileage_bucket=mileage_bucket(mileage), as_of=as_of)
+            if cluster.count >= 5:
+                sketch = cluster
+        
+        if sketch.count < 5:
+            return None
+        return sketch.mean(), sketch.median(), sketch.rank(price) * 100, sketch.count
+    
+    def _exact_market_stats(self, brand, model, mileage, price, condition, as_of=None):
+        """Market statistics for calculate_fair_price_score computed from raw listings"""
         # Filter similar cars with mileage clustering
-        similar_cars = self.df[
-            (self.df['brand'] == brand) &
-            (self.df['model'] == model) &
-            (self.df['condition'] == condition)
-        ].copy()
+        segment_cars = self._select(as_of, brand=brand, model=model, condition=condition)
+        similar_cars = segment_cars
         
         # Apply mileage clustering if mileage_v2 is available
         if 'mileage_v2' in similar_cars.columns and len(similar_cars) > 10:
@@ -54,25 +195,50 @@ class VietnameseCarPriceAnalyzer:
             # If clustering results in too few samples, use broader range
             if len(similar_cars) < 5:
                 # Fall back to original filtering without mileage clustering
-                similar_cars = self.df[
-                    (self.df['brand'] == brand) &
-                    (self.df['model'] == model) &
-                    (self.df['condition'] == condition)
-                ].copy()
+                similar_cars = segment_cars
         
         if len(similar_cars) < 5:
-            return {
-                'error': f'Insufficient data for {brand} {model}. Need at least 5 similar listings.'
-            }
+            return None
         
         # Calculate market statistics
         market_avg = similar_cars['price'].mean()
         market_median = similar_cars['price'].median()
-        market_std = similar_cars['price'].std()
         
         # Calculate price percentiles
         price_percentile = (similar_cars['price'] <= price).mean() * 100
         
+        return market_avg, market_median, price_percentile, len(similar_cars)
+    
+    def calculate_fair_price_score(self, brand, model, year, mileage, price, condition='used', approximate=False, as_of=None):
+        """
+        Calculate a fair price score (0-100) for a car based on Vietnamese market data
+        
+        Args:
+            brand (str): Car brand (e.g., 'Toyota', 'Ford')
+            model (str): Car model (e.g., 'Vios', 'Ranger')
+            year (int): Manufacturing year
+            mileage (int): Current mileage in km
+            price (float): Current listing price in VND
+            condition (str): 'new' or 'used'
+            approximate (bool): Use per-segment quantile sketches instead of raw listings
+                for the median and percentile
+            as_of (str): Snapshot version or date to score against instead of the live data
+        
+        Returns:
+            dict: Analysis results including score, market data, and recommendations
+        """
+        if approximate:
+            stats = self._approximate_market_stats(brand, model, mileage, price, condition, as_of)
+        else:
+            stats = self._exact_market_stats(brand, model, mileage, price, condition, as_of)
+        
+        if stats is None:
+            return {
+                'error': f'Insufficient data for {brand} {model}. Need at least 5 similar listings.'
+            }
+        
+        market_avg, market_median, price_percentile, similar_count = stats
+        
         # Calculate fair price score (0-100)
         # Score is based on how close the price is to market median
         price_ratio = price / market_median
@@ -122,7 +288,7 @@ class VietnameseCarPriceAnalyzer:
                     'min': int(fair_price_min),
                     'max': int(fair_price_max)
                 },
-                'similar_listings_count': len(similar_cars)
+                'similar_listings_count': similar_count
             },
             'analysis': {
                 'price_vs_median': f"{'Above' if price > market_median else 'Below'} median by {abs(price - market_median):,.0f} VND",
@@ -130,12 +296,9 @@ class VietnameseCarPriceAnalyzer:
             }
         }
     
-    def get_market_trends(self, brand, model):
+    def get_market_trends(self, brand, model, as_of=None):
         """Get market trends for a specific brand and model"""
-        model_data = self.df[
-            (self.df['brand'] == brand) &
-            (self.df['model'] == model)
-        ]
+        model_data = self._select(as_of, brand=brand, model=model)
         
         if len(model_data) < 10:
             return {'error': 'Insufficient data for trend analysis'}
@@ -150,9 +313,39 @@ class VietnameseCarPriceAnalyzer:
             'total_listings': len(model_data)
         }
     
-    def get_brand_insights(self, brand):
+    def _approximate_brand_insights(self, brand, as_of=None):
+        """get_brand_insights computed from segment sketches; only the fuel column is read from listings"""
+        sketch = self._new_sketch(as_of)
+        model_counts = {}
+        condition_counts = {}
+        for (model, condition, year, bucket), segment in self._segment_sketches(as_of).get(brand, {}).items():
+            sketch.merge(segment)
+            if pd.notna(model):
+                model_counts[model] = model_counts.get(model, 0) + segment.count
+            if pd.notna(condition):
+                condition_counts[condition] = condition_counts.get(condition, 0) + segment.count
+        
+        if sketch.count == 0:
+            return {'error': f'No data found for brand: {brand}'}
+        
+        popular_models = sorted(model_counts.items(), key=lambda item: item[1], reverse=True)[:5]
+        conditions = sorted(condition_counts.items(), key=lambda item: item[1], reverse=True)
+        fuel = self._select(as_of, columns=['fuel'], brand=brand)['fuel']
+        return {
+            'total_listings': sketch.count,
+            'average_price': int(sketch.mean()),
+            'median_price': int(sketch.median()),
+            'popular_models': dict(popular_models),
+            'condition_distribution': dict(conditions),
+            'fuel_type_distribution': fuel.value_counts().to_dict()
+        }
+    
+    def get_brand_insights(self, brand, approximate=False, as_of=None):
         """Get insights about a specific brand in the Vietnamese market"""
-        brand_data = self.df[self.df['brand'] == brand]
+        if approximate:
+            return self._approximate_brand_insights(brand, as_of)
+        
+        brand_data = self._select(as_of, brand=brand)
         
         if len(brand_data) == 0:
             return {'error': f'No data found for brand: {brand}'}
@@ -166,6 +359,34 @@ class VietnameseCarPriceAnalyzer:
             'fuel_type_distribution': brand_data['fuel'].value_counts().to_dict()
         }
 
+    def compare_score_across_versions(self, brand, model, year, mileage, price, condition='used',
+                                      versions=None, approximate=True):
+        """
+        Score the same car against several market snapshots
+
+        Args:
+            versions (list): Snapshot versions or dates to compare; defaults to every stored version
+            approximate (bool): Score from each snapshot's precomputed sketches (the default),
+                so no listing columns need to be read
+
+        Returns:
+            dict: Snapshot version -> calculate_fair_price_score result, oldest snapshot first.
+                Inputs that resolve to the same snapshot are scored once.
+        """
+        if self.snapshot_store is None:
+            raise ValueError('compare_score_across_versions requires a snapshot_store')
+        stored = self.snapshot_store.versions()
+        if versions is not None:
+            resolved = {self.snapshot_store.resolve(version) for version in versions}
+            stored = [version for version in stored if version in resolved]
+
+        return {
+            version: self.calculate_fair_price_score(
+                brand, model, year, mileage, price, condition, approximate=approximate, as_of=version
+            )
+            for version in stored
+        }
+
 def main():
     """Demo the Vietnamese Car Price Analyzer"""
     analyzer = VietnameseCarPriceAnalyzer()
@@ -0,0 +1,229 @@
+import copy
+import math
+import numpy as np
+
+
+def k_for_error(error):
+    """Return the KLL compactor size needed for a target normalized rank error (e.g. 0.01 = 1%)"""
+    if not 0 < error < 1:
+        raise ValueError(f'error must be between 0 and 1, got {error}')
+    return max(8, int(math.ceil(2.0 / error)))
+
+
+class KLLSketch:
+    """
+    Mergeable KLL quantile sketch for listing prices
+
+    Keeps a hierarchy of compactors whose total size is O(k) regardless of how many
+    prices are added. Rank queries are accurate to roughly 2/k of the segment size.
+    Count, sum, min and max are tracked exactly so averages stay exact.
+    """
+
+    C = 2.0 / 3.0
+
+    def __init__(self, k=200, seed=None):
+        if k < 8:
+            raise ValueError(f'k must be at least 8, got {k}')
+        self.k = k
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_error(cls, error, seed=None):
+        """Create an empty sketch sized for the given normalized rank error"""
+        return cls(k=k_for_error(error), seed=seed)
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.C ** depth)))
+
+    def _size(self):
+        return sum(len(items) for items in self._levels)
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self._levels)))
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            for h, items in enumerate(self._levels):
+                if len(items) < self._capacity(h):
+                    continue
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays behind so that weights remain exact
+                leftover = items[-1:] if len(items) % 2 else items[:0]
+                items = items[:len(items) - len(leftover)]
+                promoted = items[self._rng.integers(2)::2]
+                self._levels[h + 1] = np.concatenate([self._levels[h + 1], promoted])
+                self._levels[h] = leftover
+                break
+
+    def update(self, value):
+        """Add a single price to the sketch"""
+        self.update_many([value])
+
+    def update_many(self, values):
+        """Add an array of prices to the sketch, ignoring NaN values"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """Merge another sketch (e.g. from a different partition) into this one"""
+        if other.count == 0:
+            return self
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0))
+        for h, items in enumerate(other._levels):
+            self._levels[h] = np.concatenate([self._levels[h], items])
+        self.k = min(self.k, other.k)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def copy(self):
+        """Return an independent copy of the sketch"""
+        clone = KLLSketch(k=self.k)
+        clone.count = self.count
+        clone.total = self.total
+        clone.min = self.min
+        clone.max = self.max
+        clone._levels = [items.copy() for items in self._levels]
+        # Carry the generator state over so merges into the copy stay reproducible
+        clone._rng = copy.deepcopy(self._rng)
+        return clone
+
+    def to_arrays(self):
+        """Retained items and their compactor levels (an item at level h stands for 2**h prices)"""
+        values = np.concatenate(self._levels)
+        levels = np.concatenate([np.full(len(items), h, dtype=np.uint8)
+                                 for h, items in enumerate(self._levels)])
+        return values, levels
+
+    @classmethod
+    def from_arrays(cls, values, levels, count, total, min, max, k=200, seed=None):
+        """Rebuild a sketch from to_arrays() output and its exact count, sum, min and max"""
+        sketch = cls(k=k, seed=seed)
+        values = np.asarray(values, dtype=float)
+        levels = np.asarray(levels)
+        depth = int(levels.max()) + 1 if len(levels) else 1
+        sketch._levels = [values[levels == h] for h in range(depth)]
+        sketch.count = int(count)
+        sketch.total = float(total)
+        sketch.min = float(min)
+        sketch.max = float(max)
+        return sketch
+
+    def _weighted_items(self):
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items), 2 ** h, dtype=float)
+                                  for h, items in enumerate(self._levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def mean(self):
+        """Exact mean of all prices added to the sketch"""
+        if self.count == 0:
+            return math.nan
+        return self.total / self.count
+
+    def rank(self, value):
+        """Approximate fraction of prices less than or equal to value"""
+        if self.count == 0:
+            return math.nan
+        values, cumulative = self._weighted_items()
+        idx = np.searchsorted(values, value, side='right')
+        if idx == 0:
+            return 0.0
+        return float(cumulative[idx - 1] / cumulative[-1])
+
+    def quantile(self, q):
+        """
+        Approximate q-quantile of the prices added to the sketch
+
+        Args:
+            q (float): Quantile between 0 and 1 (0.5 for the median)
+
+        Returns:
+            float: Estimated price at that quantile, or NaN if the sketch is empty
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f'q must be between 0 and 1, got {q}')
+        if self.count == 0:
+            return math.nan
+        if q == 0:
+            return self.min
+        if q == 1:
+            return self.max
+        if len(self._levels) == 1:
+            # Nothing compacted yet, so every value is still held; match pandas exactly
+            return float(np.quantile(self._levels[0], q))
+        values, cumulative = self._weighted_items()
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(values[min(idx, len(values) - 1)])
+
+    def median(self):
+        """Approximate median price"""
+        return self.quantile(0.5)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f'KLLSketch(k={self.k}, count={self.count}, retained={self._size()})'
+
+
+def build_segment_sketches(df, keys, value_col='price', k=200, seed=None):
+    """
+    Build one KLL sketch per segment of a listings DataFrame
+
+    Args:
+        df (DataFrame): Listings (or one partition of them)
+        keys (list): Columns defining a segment (e.g. ['brand', 'model', 'condition'])
+        value_col (str): Column to sketch
+        k (int): Compactor size passed to each sketch
+        seed (int): Optional seed for reproducible compaction
+
+    Returns:
+        dict: Segment key tuple -> KLLSketch
+    """
+    sketches = {}
+    for key, group in df.groupby(keys, dropna=False, sort=False, observed=True):
+        if not isinstance(key, tuple):
+            key = (key,)
+        sketch = KLLSketch(k=k, seed=seed)
+        sketch.update_many(group[value_col].to_numpy(dtype=float))
+        sketches[key] = sketch
+    return sketches
+
+
+def merge_segment_sketches(*partitions):
+    """
+    Merge several flat segment-sketch dicts (e.g. built per file or per month) into one
+
+    Inputs are left untouched; see price_fairness_calculator.merge_price_sketches for the
+    analyzer's brand-nested layout.
+    """
+    merged = {}
+    for partition in partitions:
+        for key, sketch in partition.items():
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = sketch.copy()
+    return merged
@@ -0,0 +1,341 @@
+import json
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from price_fairness_calculator import build_price_sketches
+from quantile_sketch import KLLSketch
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class SnapshotSegmentSketches(Mapping):
+    """
+    Segment key -> KLLSketch for one brand of a snapshot
+
+    Keys come from the snapshot's JSON index; a sketch is only rebuilt from the
+    memory-mapped arrays when its key is looked up.
+    """
+
+    def __init__(self, snapshot, entries):
+        self._snapshot = snapshot
+        self._segment_ids = {tuple(entry[:-1]): entry[-1] for entry in entries}
+
+    def __getitem__(self, key):
+        return self._snapshot._segment_sketch(self._segment_ids[key])
+
+    def __iter__(self):
+        return iter(self._segment_ids)
+
+    def __len__(self):
+        return len(self._segment_ids)
+
+
+class MarketSnapshot:
+    """
+    One versioned market export stored as memory-mapped column files
+
+    Columns are opened with np.load(mmap_mode='r') on first use, so a query only reads
+    the pages of the columns (and rows) it actually touches. Text columns are stored as
+    integer codes plus a category list. Segment price sketches are stored the same way:
+    all retained items concatenated, with a per-segment offset table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.version = self.meta['version']
+        self.as_of_date = pd.Timestamp(self.meta['as_of_date'])
+        self.columns = self.meta['columns']
+        self.sketch_k = self.meta['sketch_k']
+        self._arrays = {}
+        self._categories = {}
+        self._category_codes = {}
+        self._price_sketches = None
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _array(self, column, folder='columns'):
+        name = os.path.join(folder, f'{column}.npy')
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name), mmap_mode='r')
+        return self._arrays[name]
+
+    def _is_categorical(self, column):
+        return column in self.meta['categorical']
+
+    def _category_list(self, column):
+        if column not in self._categories:
+            with open(os.path.join(self.path, 'columns', f'{column}.categories.json'), encoding='utf-8') as f:
+                self._categories[column] = np.array(json.load(f) + [np.nan], dtype=object)
+            self._category_codes[column] = {value: code for code, value in enumerate(self._categories[column][:-1])}
+        return self._categories[column]
+
+    def _timezone(self, column):
+        return self.meta.get('timezones', {}).get(column)
+
+    def _decode(self, column, values):
+        if self._timezone(column) is not None:
+            # Timezone-aware columns are stored as naive UTC
+            return pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(self._timezone(column))
+        if not self._is_categorical(column):
+            return np.asarray(values)
+        # Missing values are stored as -1, which indexes the trailing NaN
+        return self._category_list(column)[values]
+
+    def _match(self, column, value):
+        values = self._array(column)
+        if self._timezone(column) is not None:
+            value = pd.Timestamp(value).tz_convert('UTC').tz_localize(None).to_datetime64()
+        if not self._is_categorical(column):
+            return np.asarray(values == value)
+        self._category_list(column)
+        code = self._category_codes[column].get(value)
+        if code is None:
+            return np.zeros(len(values), dtype=bool)
+        return np.asarray(values == code)
+
+    def select(self, columns=None, **filters):
+        """
+        Load the rows matching equality filters (e.g. brand='Toyota') as a DataFrame
+
+        Only the filter columns are scanned in full; the requested columns (all by default)
+        are read for the matching rows only.
+        """
+        rows = None
+        if filters:
+            mask = np.ones(len(self), dtype=bool)
+            for column, value in filters.items():
+                mask &= self._match(column, value)
+            rows = np.flatnonzero(mask)
+
+        data = {}
+        for column in self.columns if columns is None else columns:
+            values = self._array(column)
+            data[column] = self._decode(column, values if rows is None else values[rows])
+        return pd.DataFrame(data, index=rows)
+
+    def _segment_sketch(self, segment_id):
+        offsets = self._array('offsets', 'sketches')
+        start, end = offsets[segment_id], offsets[segment_id + 1]
+        count, total, low, high = self._array('stats', 'sketches')[segment_id]
+        return KLLSketch.from_arrays(
+            self._array('values', 'sketches')[start:end], self._array('levels', 'sketches')[start:end],
+            count, total, low, high, k=self.sketch_k
+        )
+
+    @property
+    def price_sketches(self):
+        """Brand -> lazily loaded segment sketches, in the same layout as the analyzer's price_sketches"""
+        if self._price_sketches is None:
+            with open(os.path.join(self.path, 'sketches', 'index.json'), encoding='utf-8') as f:
+                index = json.load(f)
+            self._price_sketches = {
+                brand: SnapshotSegmentSketches(self, entries) for brand, entries in index.items()
+            }
+        return self._price_sketches
+
+    def close(self):
+        """Drop the memory maps and cached stats so their pages can be released"""
+        self._arrays.clear()
+        self._categories.clear()
+        self._category_codes.clear()
+        self._price_sketches = None
+
+
+class MarketSnapshotStore:
+    """
+    Directory of versioned market snapshots with lazy, LRU-bounded attachment
+
+    Layout: <root>/<version>/meta.json, columns/<column>.npy and sketches/ (values.npy,
+    levels.npy, offsets.npy, stats.npy and a JSON index of segments by brand)
+    """
+
+    def __init__(self, root='snapshots', max_attached=3):
+        self.root = root
+        self.max_attached = max_attached
+        self._attached = OrderedDict()
+        self._index = None
+        self._index_mtime = None
+
+    def _root_mtime(self):
+        try:
+            return os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self):
+        index = {}
+        # Read the mtime first, so a version added while scanning triggers another reload
+        self._index_mtime = self._root_mtime()
+        if os.path.isdir(self.root):
+            for version in os.listdir(self.root):
+                # Dot-prefixed directories are saves still in progress (or abandoned)
+                if version.startswith('.'):
+                    continue
+                meta_path = os.path.join(self.root, version, 'meta.json')
+                if os.path.exists(meta_path):
+                    with open(meta_path, encoding='utf-8') as f:
+                        index[version] = pd.Timestamp(json.load(f)['as_of_date'])
+        self._index = index
+        return index
+
+    def versions(self):
+        """List stored versions, oldest first, rescanning root when another store or process added one"""
+        if self._index is None or self._root_mtime() != self._index_mtime:
+            self._load_index()
+        index = self._index
+        return sorted(index, key=lambda version: (index[version], version))
+
+    @staticmethod
+    def _check_version_name(version):
+        if (not isinstance(version, str) or not version or version.startswith('.')
+                or os.sep in version or (os.altsep and os.altsep in version)):
+            raise ValueError(f'Invalid snapshot version name: {version!r}')
+
+    def save(self, df, version, as_of_date=None, sketch_k=200, price_sketches=None):
+        """
+        Persist a market DataFrame as a new snapshot version
+
+        Args:
+            df (DataFrame): Listings to store
+            version (str): Version name (e.g. '2024-03')
+            as_of_date: Date the snapshot represents; defaults to the latest list_date
+            sketch_k (int): Compactor size of the precomputed price sketches
+            price_sketches (dict): Sketches already built for df, saved as-is instead of rebuilt
+
+        Returns:
+            str: The saved version name
+        """
+        self._check_version_name(version)
+        path = os.path.join(self.root, version)
+        if os.path.exists(path):
+            raise ValueError(f'Snapshot version already exists: {version}')
+        if as_of_date is None:
+            as_of_date = df['list_date'].max() if 'list_date' in df.columns else pd.Timestamp.now()
+        if price_sketches is None:
+            price_sketches = build_price_sketches(df, sketch_k)
+
+        # Write into a hidden temp directory and move it into place once complete, so a
+        # failed save never leaves a half-written version behind. os.makedirs (unlike
+        # tempfile.mkdtemp) honours the umask, so other users can read the snapshot.
+        tmp_path = os.path.join(self.root, f'.{version}.{uuid.uuid4().hex}')
+        os.makedirs(tmp_path)
+        try:
+            timezones = self._write_columns(tmp_path, df)
+            self._write_sketches(tmp_path, price_sketches)
+            with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': version,
+                    'as_of_date': pd.Timestamp(as_of_date).isoformat(),
+                    'rows': len(df),
+                    'columns': [str(column) for column in df.columns],
+                    'categorical': [str(column) for column in df.columns if not self._is_array_dtype(df[column])],
+                    'timezones': timezones,
+                    'sketch_k': sketch_k
+                }, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        self._index = None
+        return version
+
+    @staticmethod
+    def _is_array_dtype(series):
+        return pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_numeric_dtype(series)
+
+    def _write_columns(self, path, df):
+        """Write one .npy per column and return the timezones of tz-aware datetime columns"""
+        os.makedirs(os.path.join(path, 'columns'))
+        timezones = {}
+        for column in df.columns:
+            series = df[column]
+            column_path = os.path.join(path, 'columns', str(column))
+            if isinstance(series.dtype, pd.DatetimeTZDtype):
+                timezones[str(column)] = str(series.dt.tz)
+                values = series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                values = series.to_numpy(dtype='datetime64[ns]')
+            elif pd.api.types.is_numeric_dtype(series):
+                values = series.to_numpy()
+                if values.dtype == object:
+                    values = series.to_numpy(dtype=float, na_value=np.nan)
+            else:
+                codes, uniques = pd.factorize(series)
+                values = codes.astype(np.int32)
+                with open(f'{column_path}.categories.json', 'w', encoding='utf-8') as f:
+                    json.dump(list(uniques), f, ensure_ascii=False, default=str)
+            np.save(f'{column_path}.npy', values)
+        return timezones
+
+    def _write_sketches(self, path, price_sketches):
+        values, levels, offsets, stats = [], [], [0], []
+        index = {}
+        for brand, segments in price_sketches.items():
+            entries = index.setdefault(str(brand), [])
+            for key, sketch in segments.items():
+                items, item_levels = sketch.to_arrays()
+                values.append(items)
+                levels.append(item_levels)
+                offsets.append(offsets[-1] + len(items))
+                stats.append([sketch.count, sketch.total, sketch.min, sketch.max])
+                entries.append([_json_value(part) for part in key] + [len(stats) - 1])
+
+        sketch_path = os.path.join(path, 'sketches')
+        os.makedirs(sketch_path)
+        np.save(os.path.join(sketch_path, 'values.npy'), np.concatenate(values) if values else np.empty(0))
+        np.save(os.path.join(sketch_path, 'levels.npy'), np.concatenate(levels) if levels else np.empty(0, dtype=np.uint8))
+        np.save(os.path.join(sketch_path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(sketch_path, 'stats.npy'), np.array(stats, dtype=float).reshape(-1, 4))
+        with open(os.path.join(sketch_path, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+
+    def resolve(self, as_of):
+        """Map a version name or a date to the latest snapshot taken on or before it"""
+        try:
+            return self._resolve(as_of, self.versions())
+        except ValueError:
+            # The root mtime can miss a save made within the same filesystem tick; rescan once
+            self._load_index()
+            return self._resolve(as_of, self.versions())
+
+    def _resolve(self, as_of, versions):
+        if as_of in versions:
+            return as_of
+        try:
+            as_of_date = pd.Timestamp(as_of)
+        except (TypeError, ValueError):
+            raise ValueError(f'Unknown snapshot version: {as_of}')
+        candidates = [version for version in versions if self._index[version] <= as_of_date]
+        if not candidates:
+            raise ValueError(f'No snapshot on or before {as_of_date.date()}')
+        return candidates[-1]
+
+    def attach(self, as_of):
+        """Return the snapshot for a version or date, evicting the least recently used ones"""
+        version = self.resolve(as_of)
+        if version in self._attached:
+            self._attached.move_to_end(version)
+            return self._attached[version]
+
+        snapshot = MarketSnapshot(os.path.join(self.root, version))
+        self._attached[version] = snapshot
+        while len(self._attached) > self.max_attached:
+            _, evicted = self._attached.popitem(last=False)
+            evicted.close()
+        return snapshot
+
+    def detach(self, as_of):
+        """Release a snapshot's memory maps"""
+        snapshot = self._attached.pop(self.resolve(as_of), None)
+        if snapshot is not None:
+            snapshot.close()
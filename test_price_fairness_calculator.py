@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+from price_fairness_calculator import (
+    UNKNOWN_MILEAGE_BUCKET, build_price_sketches, build_price_sketches_from_chunks,
+    merge_price_sketches, mileage_bucket, mileage_buckets
+)
+
+LISTING_MILEAGES = pd.Series([0, 1, 9999, 10000, 10001, 30000, 30001, 80000, 120000, 120001, 500000, np.nan, -5])
+QUERY_MILEAGES = [0, 1, 10000, 10001, 30000, 50000, 80000, 80001, 120000, 120001, 300000]
+
+
+def legacy_cluster(mileages, mileage):
+    """The if/elif mileage clustering that mileage_bucket replaced"""
+    if mileage == 0:
+        return mileages == 0
+    elif mileage <= 10000:
+        return (mileages > 0) & (mileages <= 10000)
+    elif mileage <= 30000:
+        return (mileages > 10000) & (mileages <= 30000)
+    elif mileage <= 50000:
+        return (mileages > 30000) & (mileages <= 50000)
+    elif mileage <= 80000:
+        return (mileages > 50000) & (mileages <= 80000)
+    elif mileage <= 120000:
+        return (mileages > 80000) & (mileages <= 120000)
+    else:
+        return mileages > 120000
+
+
+@pytest.mark.parametrize('mileage', QUERY_MILEAGES)
+def test_mileage_buckets_match_legacy_clusters(mileage):
+    expected = legacy_cluster(LISTING_MILEAGES, mileage)
+    assert (mileage_buckets(LISTING_MILEAGES) == mileage_bucket(mileage)).tolist() == expected.tolist()
+
+
+def test_mileage_bucket_boundaries():
+    assert [mileage_bucket(m) for m in [0, 10000, 10001, 120000, 120001]] == [0, 1, 2, 5, 6]
+    buckets = mileage_buckets(pd.Series([np.nan, -5, 0]))
+    assert buckets.tolist() == [UNKNOWN_MILEAGE_BUCKET, UNKNOWN_MILEAGE_BUCKET, 0]
+
+
+def test_build_price_sketches_counts_match_groupby(listings):
+    sketches = build_price_sketches(listings)
+    years = listings['manufacture_date'].astype(object).where(listings['manufacture_date'].notna(), None)
+    expected = listings.groupby(
+        [listings['brand'], listings['model'], listings['condition'], years, mileage_buckets(listings['mileage_v2'])],
+        dropna=False
+    ).size()
+    counts = {(brand,) + key: sketch.count for brand, segments in sketches.items() for key, sketch in segments.items()}
+    assert counts == {tuple(None if pd.isna(part) else part for part in key): n for key, n in expected.items()}
+
+
+def test_chunked_build_matches_full_build(listings):
+    full = build_price_sketches(listings)
+    chunks = [listings.iloc[start:start + 100] for start in range(0, len(listings), 100)]
+    chunked = build_price_sketches_from_chunks(chunks)
+    assert chunked.keys() == full.keys()
+    for brand, segments in full.items():
+        assert chunked[brand].keys() == segments.keys()
+        for key, sketch in segments.items():
+            assert chunked[brand][key].count == sketch.count
+            assert chunked[brand][key].median() == sketch.median()
+
+
+def test_merge_price_sketches_leaves_inputs_untouched(listings):
+    first, second = build_price_sketches(listings[:200]), build_price_sketches(listings[200:])
+    before = sum(sketch.count for segments in first.values() for sketch in segments.values())
+    merged = merge_price_sketches(first, second)
+    assert sum(sketch.count for segments in merged.values() for sketch in segments.values()) == len(listings)
+    assert sum(sketch.count for segments in first.values() for sketch in segments.values()) == before
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'model': 'Vios'},
+    {'model': 'Vios', 'condition': 'used'},
+    {'model': 'Ranger', 'condition': 'new', 'year': 2020.0},
+    {'model': 'Vios', 'condition': 'used', 'mileage_bucket': 2},
+])
+def test_get_price_sketch_filters(listings, load_analyzer, filters):
+    analyzer = load_analyzer(listings)
+    mask = listings['brand'] == 'Toyota'
+    columns = {'model': listings['model'], 'condition': listings['condition'],
+               'year': listings['manufacture_date'], 'mileage_bucket': mileage_buckets(listings['mileage_v2'])}
+    for name, value in filters.items():
+        mask &= columns[name] == value
+    sketch = analyzer.get_price_sketch('Toyota', **filters)
+    assert sketch.count == mask.sum()
+    assert sketch.median() == listings.loc[mask, 'price'].median()
+
+
+def test_approximate_score_matches_exact_on_small_segments(listings, load_analyzer):
+    analyzer = load_analyzer(listings)
+    for brand in ['Toyota', 'Ford', 'Honda']:
+        for model in ['Vios', 'Ranger']:
+            for condition in ['used', 'new']:
+                for mileage in [0, 5000, 10000, 10001, 45000, 120000, 120001, 300000]:
+                    for price in [350_000_000, 600_000_000, 850_000_000]:
+                        args = (brand, model, 2020, mileage, price, condition)
+                        exact = analyzer.calculate_fair_price_score(*args)
+                        assert analyzer.calculate_fair_price_score(*args, approximate=True) == exact
+
+
+def test_approximate_brand_insights_match_exact(listings, load_analyzer):
+    analyzer = load_analyzer(listings)
+    for brand in ['Toyota', 'Ford', 'Honda', 'BMW']:
+        assert analyzer.get_brand_insights(brand, approximate=True) == analyzer.get_brand_insights(brand)
@@ -0,0 +1,104 @@
+import math
+import numpy as np
+import pytest
+from quantile_sketch import KLLSketch, merge_segment_sketches
+
+K = 200
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+
+def prices(n, seed=0):
+    return np.random.default_rng(seed).lognormal(20, 0.5, n)
+
+
+def max_rank_error(sketch, values):
+    values = np.sort(values)
+    errors = []
+    for q in QUANTILES:
+        estimate = sketch.quantile(q)
+        errors.append(abs(np.searchsorted(values, estimate, side='right') / len(values) - q))
+        true_rank = np.searchsorted(values, np.quantile(values, q), side='right') / len(values)
+        errors.append(abs(sketch.rank(np.quantile(values, q)) - true_rank))
+    return max(errors)
+
+
+def test_update_many_rank_error():
+    values = prices(200000)
+    sketch = KLLSketch(k=K, seed=0)
+    for chunk in np.array_split(values, 10):
+        sketch.update_many(chunk)
+    assert max_rank_error(sketch, values) <= 2 / K
+
+
+def test_single_updates_rank_error():
+    values = prices(20000, seed=1)
+    sketch = KLLSketch(k=K, seed=0)
+    for value in values:
+        sketch.update(value)
+    assert max_rank_error(sketch, values) <= 2 / K
+
+
+def test_merge_rank_error():
+    values = prices(200000, seed=2)
+    partitions = []
+    for i, chunk in enumerate(np.array_split(values, 50)):
+        partition = KLLSketch(k=K, seed=i)
+        partition.update_many(chunk)
+        partitions.append(partition)
+    merged = KLLSketch(k=K, seed=0)
+    for partition in partitions:
+        merged.merge(partition)
+    assert merged.count == len(values)
+    assert max_rank_error(merged, values) <= 2 / K
+
+
+def test_merge_segment_sketches_keeps_inputs():
+    a, b = KLLSketch(k=K, seed=0), KLLSketch(k=K, seed=1)
+    a.update_many([1, 2, 3])
+    b.update_many([4, 5])
+    merged = merge_segment_sketches({('Toyota',): a}, {('Toyota',): b, ('Ford',): b})
+    assert merged[('Toyota',)].count == 5
+    assert merged[('Ford',)].count == 2
+    assert a.count == 3
+
+
+def test_merges_into_copies_are_reproducible():
+    first, second = KLLSketch(k=K, seed=0), KLLSketch(k=K, seed=1)
+    first.update_many(prices(5000, seed=4))
+    second.update_many(prices(5000, seed=5))
+    retained = set()
+    for _ in range(5):
+        merged = merge_segment_sketches({'segment': first}, {'segment': second})
+        retained.add(tuple(np.sort(merged['segment'].to_arrays()[0])))
+    assert len(retained) == 1
+
+
+def test_exact_count_min_max_mean():
+    values = prices(100000, seed=3)
+    sketch = KLLSketch(k=K, seed=0)
+    sketch.update_many(values)
+    sketch.update_many([math.nan])
+    assert sketch.count == len(values)
+    assert sketch.min == values.min()
+    assert sketch.max == values.max()
+    assert sketch.mean() == pytest.approx(values.mean(), rel=1e-12)
+    assert sketch.quantile(0) == values.min()
+    assert sketch.quantile(1) == values.max()
+
+
+def test_uncompacted_sketch_matches_exact_quantiles():
+    sketch = KLLSketch(k=K)
+    sketch.update_many([100, 200, 300, 400])
+    assert sketch.median() == 250
+    assert sketch.quantile(0.25) == np.quantile([100, 200, 300, 400], 0.25)
+    assert sketch.rank(200) == 0.5
+
+
+def test_empty_sketch_returns_nan():
+    sketch = KLLSketch(k=K)
+    assert sketch.count == 0
+    assert math.isnan(sketch.mean())
+    assert math.isnan(sketch.median())
+    assert math.isnan(sketch.rank(100))
+    with pytest.raises(ValueError):
+        sketch.quantile(1.5)
@@ -0,0 +1,139 @@
+import os
+import pandas as pd
+import pytest
+from price_fairness_calculator import VietnameseCarPriceAnalyzer, build_price_sketches
+from snapshot_store import MarketSnapshotStore
+
+CASES = [
+    ('Toyota', 'Vios', 2020, 10000, 450_000_000, 'used'),
+    ('Ford', 'Ranger', 2018, 120001, 700_000_000, 'used'),
+    ('Honda', 'Vios', 2020, 0, 600_000_000, 'new'),
+    ('BMW', 'X5', 2020, 0, 600_000_000, 'new'),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MarketSnapshotStore(str(tmp_path / 'snapshots'))
+
+
+@pytest.fixture
+def saved(store, load_analyzer, listings_factory):
+    """Two monthly snapshots; returns the live analyzer for each"""
+    march = load_analyzer(listings_factory(seed=1), snapshot_store=store)
+    march.save_snapshot('2024-03', as_of_date='2024-03-31')
+    april = load_analyzer(listings_factory(seed=2, price_scale=1.1), snapshot_store=store)
+    april.save_snapshot('2024-04', as_of_date='2024-04-30')
+    return {'2024-03': march, '2024-04': april}
+
+
+@pytest.mark.parametrize('approximate', [False, True])
+def test_as_of_scores_match_live_analyzer(store, saved, approximate):
+    history = VietnameseCarPriceAnalyzer(data_file=None, snapshot_store=MarketSnapshotStore(store.root))
+    for version, live in saved.items():
+        for case in CASES:
+            expected = live.calculate_fair_price_score(*case, approximate=approximate)
+            assert history.calculate_fair_price_score(*case, approximate=approximate, as_of=version) == expected
+        assert history.get_brand_insights('Ford', approximate=approximate, as_of=version) == \
+            live.get_brand_insights('Ford', approximate=approximate)
+        assert history.get_market_trends('Toyota', 'Vios', as_of=version) == live.get_market_trends('Toyota', 'Vios')
+
+
+def test_store_only_analyzer_rejects_live_queries(store, saved):
+    history = VietnameseCarPriceAnalyzer(data_file=None, snapshot_store=store)
+    with pytest.raises(ValueError):
+        history.calculate_fair_price_score(*CASES[0])
+    with pytest.raises(ValueError):
+        history.get_brand_insights('Ford', approximate=True)
+    with pytest.raises(ValueError):
+        VietnameseCarPriceAnalyzer(data_file=None)
+
+
+def test_dates_resolve_to_latest_earlier_version(store, saved):
+    assert store.versions() == ['2024-03', '2024-04']
+    assert store.resolve('2024-04') == '2024-04'
+    assert store.resolve('2024-04-15') == '2024-03'
+    assert store.resolve(pd.Timestamp('2025-01-01')) == '2024-04'
+    with pytest.raises(ValueError):
+        store.resolve('2024-01-01')
+    with pytest.raises(ValueError):
+        store.resolve('not-a-version')
+
+
+def test_compare_scores_each_snapshot_once_oldest_first(store, saved):
+    history = VietnameseCarPriceAnalyzer(data_file=None, snapshot_store=store)
+    results = history.compare_score_across_versions(*CASES[0], versions=['2024-04', '2024-03-31', '2024-03'])
+    assert list(results) == ['2024-03', '2024-04']
+    assert results['2024-04'] == saved['2024-04'].calculate_fair_price_score(*CASES[0], approximate=True)
+
+
+def test_versions_saved_by_another_store_are_visible(store, saved, listings_factory):
+    store.attach('2024-03')
+    other = MarketSnapshotStore(store.root)
+    other.save(listings_factory(seed=3), '2024-05', as_of_date='2024-05-31')
+    assert store.attach('2024-05').version == '2024-05'
+    assert store.resolve('2024-06-01') == '2024-05'
+
+
+def test_lru_eviction_closes_snapshots(store, saved):
+    store.max_attached = 1
+    march = store.attach('2024-03')
+    march.select(brand='Toyota')
+    assert march._arrays
+    april = store.attach('2024-04')
+    assert list(store._attached) == ['2024-04']
+    assert not march._arrays and march._price_sketches is None
+    assert store.attach('2024-04') is april
+
+
+def test_failed_save_leaves_no_version(store, saved, listings_factory):
+    class BrokenSketches(dict):
+        def items(self):
+            raise RuntimeError('disk full')
+
+    with pytest.raises(RuntimeError):
+        store.save(listings_factory(seed=3), '2024-05', price_sketches=BrokenSketches())
+    assert store.versions() == ['2024-03', '2024-04']
+    assert sorted(os.listdir(store.root)) == ['2024-03', '2024-04']
+    store.save(listings_factory(seed=3), '2024-05', as_of_date='2024-05-31')
+    assert store.versions() == ['2024-03', '2024-04', '2024-05']
+
+
+def test_saved_snapshot_honours_umask(store, saved):
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(os.path.join(store.root, '2024-03')).st_mode & 0o777 == 0o777 & ~umask
+
+
+@pytest.mark.parametrize('version', ['', '.hidden', '../escape', os.path.join('a', 'b'), None])
+def test_invalid_version_names_are_rejected(store, version, listings_factory):
+    with pytest.raises(ValueError):
+        store.save(listings_factory(), version)
+
+
+def test_sketches_round_trip_through_mmap_arrays(store, listings_factory):
+    listings = listings_factory(rows=200000, seed=4)
+    sketches = build_price_sketches(listings)
+    store.save(listings, '2024-03', as_of_date='2024-03-31', price_sketches=sketches)
+    loaded = store.attach('2024-03').price_sketches
+    assert loaded.keys() == sketches.keys()
+    for brand, segments in sketches.items():
+        assert set(loaded[brand]) == set(segments)
+        for key, sketch in segments.items():
+            restored = loaded[brand][key]
+            assert (restored.count, restored.total, restored.min, restored.max) == \
+                (sketch.count, sketch.total, sketch.min, sketch.max)
+            for q in [0.1, 0.25, 0.5, 0.75, 0.9]:
+                assert restored.quantile(q) == sketch.quantile(q)
+
+
+def test_columns_round_trip_including_timezones(store, listings_factory):
+    listings = listings_factory(rows=50)
+    listings['list_date'] = pd.to_datetime(listings['list_time'], unit='ms').dt.tz_localize('UTC').dt.tz_convert('+07:00')
+    listings.loc[3, 'model'] = None
+    store.save(listings, '2024-03', as_of_date='2024-03-31')
+    restored = store.attach('2024-03').select()
+    pd.testing.assert_frame_equal(restored, listings, check_dtype=False)
+    assert str(restored['list_date'].dt.tz) == str(listings['list_date'].dt.tz)
+    toyota = store.attach('2024-03').select(brand='Toyota')
+    pd.testing.assert_frame_equal(toyota, listings[listings['brand'] == 'Toyota'], check_dtype=False)
@@ -4,7 +4,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
-from price_fairness_calculator import VietnameseCarPriceAnalyzer
+from price_fairness_calculator import VietnameseCarPriceAnalyzer, mileage_bucket, mileage_buckets
 
 # Page configuration
 st.set_page_config(
@@ -55,9 +55,54 @@ def get_years_for_brand_model(brand, model):
     years = [int(year) for year in years if pd.notna(year)]
     return sorted(years, reverse=True)
 
+MILEAGE_CLUSTER_NAMES = {
+    0: "Xe mới (0 km)",
+    1: "Xe đã sử dụng (0-10,000 km)",
+    2: "Xe đã sử dụng (10,000-30,000 km)",
+    3: "Xe đã sử dụng (30,000-50,000 km)",
+    4: "Xe đã sử dụng (50,000-80,000 km)",
+    5: "Xe đã sử dụng (80,000-120,000 km)",
+    6: "Xe đã sử dụng (trên 120,000 km)"
+}
+
+def get_sketch_stats_for_selection(brand, model, year, mileage=None):
+    """Approximate price statistics for the selection, read only from the analyzer's segment sketches"""
+    if 'manufacture_date' not in analyzer.df.columns:
+        year = None
+    sketch = analyzer.get_price_sketch(brand, model, year=year)
+    
+    if sketch.count == 0:
+        return None
+    
+    stats = {}
+    if mileage is not None and 'mileage_v2' in analyzer.df.columns:
+        bucket = mileage_bucket(mileage)
+        cluster = analyzer.get_price_sketch(brand, model, year=year, mileage_bucket=bucket)
+        
+        # If no data in the specific cluster, fall back to overall data
+        if cluster.count < 3:
+            stats['cluster_name'] = f"Tất cả {brand} {model} ({year})"
+        else:
+            sketch = cluster
+            stats['cluster_name'] = MILEAGE_CLUSTER_NAMES[bucket]
+    
+    # Sketches only track prices, so mileage is not available in approximate mode
+    return {
+        'count': sketch.count,
+        'avg_price': int(sketch.mean()),
+        'median_price': int(sketch.median()),
+        'min_price': int(sketch.min),
+        'max_price': int(sketch.max),
+        'avg_mileage': None,
+        **stats
+    }
+
 @st.cache_data
-def get_price_stats_for_selection(brand, model, year, mileage=None):
+def get_price_stats_for_selection(brand, model, year, mileage=None, approximate=False):
     """Get price statistics for the selected brand, model, and year with optional mileage clustering"""
+    if approximate:
+        return get_sketch_stats_for_selection(brand, model, year, mileage)
+    
     selection_data = analyzer.df[
         (analyzer.df['brand'] == brand) & 
         (analyzer.df['model'] == model)
@@ -72,29 +117,9 @@ def get_price_stats_for_selection(brand, model, year, mileage=None):
     
     # If mileage is provided, cluster the data based on mileage_v2
     if mileage is not None and 'mileage_v2' in selection_data.columns:
-        # Create mileage clusters
-        # Define mileage ranges for clustering
-        if mileage == 0:  # New car
-            cluster_data = selection_data[selection_data['mileage_v2'] == 0]
-            cluster_name = "Xe mới (0 km)"
-        elif mileage <= 10000:
-            cluster_data = selection_data[(selection_data['mileage_v2'] > 0) & (selection_data['mileage_v2'] <= 10000)]
-            cluster_name = "Xe đã sử dụng (0-10,000 km)"
-        elif mileage <= 30000:
-            cluster_data = selection_data[(selection_data['mileage_v2'] > 10000) & (selection_data['mileage_v2'] <= 30000)]
-            cluster_name = "Xe đã sử dụng (10,000-30,000 km)"
-        elif mileage <= 50000:
-            cluster_data = selection_data[(selection_data['mileage_v2'] > 30000) & (selection_data['mileage_v2'] <= 50000)]
-            cluster_name = "Xe đã sử dụng (30,000-50,000 km)"
-        elif mileage <= 80000:
-            cluster_data = selection_data[(selection_data['mileage_v2'] > 50000) & (selection_data['mileage_v2'] <= 80000)]
-            cluster_name = "Xe đã sử dụng (50,000-80,000 km)"
-        elif mileage <= 120000:
-            cluster_data = selection_data[(selection_data['mileage_v2'] > 80000) & (selection_data['mileage_v2'] <= 120000)]
-            cluster_name = "Xe đã sử dụng (80,000-120,000 km)"
-        else:
-            cluster_data = selection_data[selection_data['mileage_v2'] > 120000]
-            cluster_name = "Xe đã sử dụng (trên 120,000 km)"
+        bucket = mileage_bucket(mileage)
+        cluster_data = selection_data[mileage_buckets(selection_data['mileage_v2']) == bucket]
+        cluster_name = MILEAGE_CLUSTER_NAMES[bucket]
         
         # If no data in the specific cluster, fall back to overall data
         if len(cluster_data) < 3:
@@ -131,6 +156,11 @@ page = st.sidebar.selectbox(
     "Chọn tính năng:",
     ["🏷️ Price Fairness Indicator", "📊 Market Insights"]
 )
+approximate = st.sidebar.checkbox(
+    "Thống kê xấp xỉ (nhanh hơn)",
+    value=False,
+    help="Tính giá trung vị và thống kê giá từ bản tóm tắt phân vị thay vì toàn bộ dữ liệu"
+)
 
 if page == "🏷️ Price Fairness Indicator":
     st.header("🏷️ Price Fairness Indicator")
@@ -182,7 +212,7 @@ if page == "🏷️ Price Fairness Indicator":
     if st.button("🔍 Phân tích giá", type="primary"):
         if brand and model and year:
             # Get price statistics for the selection with mileage clustering
-            stats = get_price_stats_for_selection(brand, model, year, mileage)
+            stats = get_price_stats_for_selection(brand, model, year, mileage, approximate)
             if stats:
                 st.info(f"**💰 Giá trị ước tính cho xe {brand} {model} ({year}): {stats['avg_price']:,} VND**")
         else:
@@ -250,7 +280,7 @@ elif page == "📊 Market Insights":
     )
     
     if selected_brand:
-        brand_insights = analyzer.get_brand_insights(selected_brand)
+        brand_insights = analyzer.get_brand_insights(selected_brand, approximate=approximate)
         
         if 'error' not in brand_insights:
             col1, col2 = st.columns(2)